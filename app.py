@@ -1,20 +1,35 @@
 import re
 import streamlit as st
 import pandas as pd
-import os
 import base64
-from datetime import datetime
+from datetime import date, datetime
+from io import BytesIO
 from textwrap import dedent
-from sqlalchemy import create_engine
+from openpyxl import Workbook
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import ProgrammingError
 from urllib.parse import quote_plus
-from db_it_pei import get_engine, fetch_last_by_ue, insert_it_pei, search_history, update_it_pei
+from convertir_a_parquet import parquet_vigente
+from normalizacion import (
+    ESTADO_MAP, ETAPA_MAP, FIELD_ALIASES, HIST_CHOICE_MAPS, TIPO_PEI_MAP, VIGENCIA_MAP,
+    first_present, norm_choice, normalize_col,
+)
+from db_it_pei import (
+    HISTORIAL_EXCEL_COLUMNS, HISTORIAL_EXCEL_TABLE, get_engine,
+    fetch_historial_ue, fetch_last_by_ue, insert_it_pei, search_history, update_it_pei,
+)
 
-def guardar_en_historial_excel(nuevo: dict, path: str):
+def guardar_en_historial_excel(nuevo: dict, engine):
     """
-    Guarda un nuevo registro en el Excel historial_it_pei.xlsx
-    - Si el archivo no existe, lo crea
-    - Si existe, agrega una nueva fila
+    Guarda un nuevo registro en la tabla espejo del historial Excel (Postgres)
+    - La tabla la crea migraciones.py (HISTORIAL_EXCEL_DDL); la app no ejecuta DDL
+    - Agrega una nueva fila (INSERT de 1 fila, sin reescribir el historial)
+    - Si la tabla no existe -> RuntimeError que indica ejecutar migraciones.py
+    - Claves que no existen en la tabla -> ValueError (no se guarda nada)
     """
+    desconocidas = [k for k in nuevo if k not in HISTORIAL_EXCEL_COLUMNS]
+    if desconocidas:
+        raise ValueError(f"Columnas no válidas para {HISTORIAL_EXCEL_TABLE}: {', '.join(desconocidas)}")
 
     # Normalización robusta del código
     def normalizar_codigo(x):
@@ -25,24 +40,46 @@ def guardar_en_historial_excel(nuevo: dict, path: str):
         except Exception:
             return str(x).strip()
 
-    # 1) Dict -> DataFrame (1 fila)
-    df_nuevo = pd.DataFrame([nuevo])
-
-    # 2) Asegurar columna normalizada
-    df_nuevo["codigo_ue_norm"] = df_nuevo["codigo"].apply(normalizar_codigo)
+    # 1) Asegurar columna normalizada (sin modificar el dict del llamador)
+    fila = {**nuevo, "codigo_ue_norm": normalizar_codigo(nuevo.get("codigo"))}
 
-    # 3) Crear archivo si no existe
-    if not os.path.exists(path):
-        df_nuevo.to_excel(path, index=False, engine="openpyxl")
-        return
+    # 2) INSERT explícito: to_sql crearía la tabla con tipos inferidos si no existe.
+    #    "año" no es un nombre de bind válido: binds posicionales c0, c1, ...
+    cols = list(fila)
+    col_sql = ", ".join(f'"{c}"' for c in cols)
+    val_sql = ", ".join(f":c{i}" for i in range(len(cols)))
+    stmt = text(f"INSERT INTO {HISTORIAL_EXCEL_TABLE} ({col_sql}) VALUES ({val_sql})")
+    try:
+        with engine.begin() as conn:
+            conn.execute(stmt, {f"c{i}": fila[c] for i, c in enumerate(cols)})
+    except ProgrammingError as e:
+        # 42P01 = undefined_table
+        if getattr(e.orig, "pgcode", None) == "42P01":
+            raise RuntimeError(
+                f"No existe la tabla {HISTORIAL_EXCEL_TABLE}: ejecuta `python migraciones.py`."
+            ) from e
+        raise
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def export_historial_excel(_engine) -> bytes:
+    """
+    Exporta la tabla espejo a .xlsx (bytes) para descargas.
+    Usa openpyxl en modo write_only para no construir el DOM completo.
+    La app no la llama: queda para quien necesite el .xlsx (p. ej. un st.download_button).
+    """
+    df = pd.read_sql(f"SELECT * FROM {HISTORIAL_EXCEL_TABLE}", _engine)
+    df = df.astype(object).where(df.notna(), None)
 
-    # 4) Leer historial existente
-    df_hist = pd.read_excel(path, engine="openpyxl")
-    df_hist.columns = df_hist.columns.astype(str).str.strip()
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("historial")
+    ws.append(list(df.columns))
+    for fila in df.itertuples(index=False, name=None):
+        ws.append(fila)
 
-    # 5) Concatenar y sobrescribir
-    df_final = pd.concat([df_hist, df_nuevo], ignore_index=True, sort=False)
-    df_final.to_excel(path, index=False, engine="openpyxl")
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
 
 
 # =====================================
@@ -102,126 +139,145 @@ def set_form_state_from_row(row: pd.Series):
             return 0
 
     def _safe_date(x):
-        if pd.isna(x) or x is None or str(x).strip() == "":
+        if pd.isna(x) or x is None:
+            return None
+        # psycopg2 ya entrega date/datetime nativos: sin reconversión
+        if isinstance(x, datetime):
+            return x.date()
+        if isinstance(x, date):
+            return x
+        if str(x).strip() == "":
             return None
         try:
             return pd.to_datetime(x).date()
         except Exception:
             return None
 
-    # Normalizador tolerante para valores de selectbox (mayúsculas, espacios, guiones bajos)
-    def norm_choice(val, mapping: dict, default: str):
-        s = _safe_str(val).lower()
-        s = re.sub(r"\s+", " ", s)
-        s = s.replace("_", " ").strip()
-        return mapping.get(s, default)
-
-    # Mapeos a los valores EXACTOS que usa tu formulario
-    estado_map = {
-        "emitido": "Emitido",
-        "en proceso": "En proceso",
-        "proceso": "En proceso",
-    }
-
-    vigencia_map = {
-        "sí": "Sí",
-        "si": "Sí",
-        "no": "No",
-    }
-
-    tipo_pei_map = {
-        "formulado": "Formulado",
-        "ampliado": "Ampliado",
-        "actualizado": "Actualizado",
-    }
-
-    etapa_map = {
-        "it emitido": "IT Emitido",
-        "para emisión de it": "Para emisión de IT",
-        "para emision de it": "Para emisión de IT",
-        "revisión dncp": "Revisión DNCP",
-        "revision dncp": "Revisión DNCP",
-        "revisión dnse": "Revisión DNSE",
-        "revision dnse": "Revisión DNSE",
-        "revisión dnpe": "Revisión DNPE",
-        "revision dnpe": "Revisión DNPE",
-        "subsanación del pliego": "Subsanación del pliego",
-        "subsanacion del pliego": "Subsanación del pliego",
-    }
-
-    # ============================================================
-    # Resolver nombres de columnas (Postgres vs SharePoint)
-    # ============================================================
-    # Preferimos Postgres si existe, sino caemos a nombres antiguos.
-    tipo_pei_val = row.get("tipo_pei", row.get("Tipo de PEI", FORM_DEFAULTS["tipo_pei"]))
-
-    etapa_val = row.get("etapas_revision", row.get("etapa_revision", row.get("Etapas de revisión", FORM_DEFAULTS["etapa_revision"])))
-
-    periodo_val = row.get("periodo_pei", row.get("periodo", row.get("Periodo PEI", "")))
-
-    comentario_val = row.get("comentario_adicional_emisor_it", row.get("comentario", row.get("Comentario adicional/ Emisor de I.T", "")))
+    def _valor(campo):
+        return first_present(row, FIELD_ALIASES[campo], FORM_DEFAULTS[campo])
 
     # ============================================================
     # --- CARGA NORMALIZADA ---
     # ============================================================
     form["tipo_pei"] = norm_choice(
-        tipo_pei_val,
-        tipo_pei_map,
+        _valor("tipo_pei"),
+        TIPO_PEI_MAP,
         FORM_DEFAULTS["tipo_pei"]
     )
 
     form["etapa_revision"] = norm_choice(
-        etapa_val,
-        etapa_map,
+        _valor("etapa_revision"),
+        ETAPA_MAP,
         FORM_DEFAULTS["etapa_revision"]
     )
 
-    form["fecha_recepcion"] = _safe_date(row.get("fecha_recepcion", row.get("Fecha de recepción")))
-    form["articulacion"] = _safe_str(row.get("articulacion", row.get("Articulación", "")))
-    form["fecha_derivacion"] = _safe_date(row.get("fecha_derivacion", row.get("Fecha de derivación")))
+    form["fecha_recepcion"] = _safe_date(_valor("fecha_recepcion"))
+    form["articulacion"] = _safe_str(_valor("articulacion"))
+    form["fecha_derivacion"] = _safe_date(_valor("fecha_derivacion"))
 
-    form["periodo"] = _safe_str(periodo_val)
-    form["cantidad_revisiones"] = _safe_int(row.get("cantidad_revisiones", row.get("Cantidad de revisiones", 0)))
-    form["comentario"] = _safe_str(comentario_val)
+    form["periodo"] = _safe_str(_valor("periodo"))
+    form["cantidad_revisiones"] = _safe_int(_valor("cantidad_revisiones"))
+    form["comentario"] = _safe_str(_valor("comentario"))
 
     form["vigencia"] = norm_choice(
-        row.get("vigencia", row.get("Vigencia", FORM_DEFAULTS["vigencia"])),
-        vigencia_map,
+        _valor("vigencia"),
+        VIGENCIA_MAP,
         FORM_DEFAULTS["vigencia"]
     )
 
     # ✅ Mantiene tu fix del bug: estado correctamente cargado desde historial
     form["estado"] = norm_choice(
-        row.get("estado", row.get("Estado", FORM_DEFAULTS["estado"])),
-        estado_map,
+        _valor("estado"),
+        ESTADO_MAP,
         FORM_DEFAULTS["estado"]
     )
 
-    form["expediente"] = _safe_str(row.get("expediente", row.get("Expediente", "")))
-    form["fecha_it"] = _safe_date(row.get("fecha_it", row.get("Fecha de I.T")))
-    form["numero_it"] = _safe_str(row.get("numero_it", row.get("Número de I.T", "")))
-    form["fecha_oficio"] = _safe_date(row.get("fecha_oficio", row.get("Fecha Oficio", row.get("Fecha del Oficio"))))
-    form["numero_oficio"] = _safe_str(row.get("numero_oficio", row.get("Número Oficio", row.get("Número del Oficio", ""))))
+    form["expediente"] = _safe_str(_valor("expediente"))
+    form["fecha_it"] = _safe_date(_valor("fecha_it"))
+    form["numero_it"] = _safe_str(_valor("numero_it"))
+    form["fecha_oficio"] = _safe_date(_valor("fecha_oficio"))
+    form["numero_oficio"] = _safe_str(_valor("numero_oficio"))
 
     st.session_state[FORM_STATE_KEY] = form
 
 engine = get_engine()
 
-# Confirmación de conexión (temporal)
-with engine.begin() as conn:
-    ok = conn.exec_driver_sql("SELECT 1").scalar()
-st.success(f"Conexión OK: {ok}")
+# Confirmación de conexión (temporal): una sola vez por proceso
+@st.cache_resource(show_spinner=False)
+def _probe(_engine):
+    with _engine.begin() as conn:
+        return conn.exec_driver_sql("SELECT 1").scalar()
+
+ok = _probe(engine)
+if not st.session_state.setdefault("_probed", False):
+    st.success(f"Conexión OK: {ok}")
+    st.session_state["_probed"] = True
 
 # =====================================
 # 🏛️ Carga y búsqueda de unidades ejecutoras
 # =====================================
-@st.cache_data
+UE_PARQUET = "data/unidades_ejecutoras.parquet"
+UE_XLSX = "data/unidades_ejecutoras.xlsx"
+
+UE_COLUMNAS_TEXTO = ("codigo", "NG", "Responsable_Institucional")
+
+@st.cache_resource(ttl=3600)
 def cargar_unidades_ejecutoras():
-    return pd.read_excel("data/unidades_ejecutoras.xlsx", engine="openpyxl")
+    """
+    Devuelve {"df", "responsables", "por_responsable", "opciones"}: el DataFrame de UEs
+    ya normalizado y todo lo que se deriva de él, calculado en la misma carga para que
+    expire junto con el ttl (si no, los derivados seguirían mostrando el Excel anterior).
+    Es un único objeto compartido entre todas las sesiones (cache_resource):
+    NO mutarlo fuera de esta función.
+    Responsable_Institucional y NG se guardan como category: menos memoria y filtros más rápidos.
+    """
+    # Parquet generado con convertir_a_parquet.py (commiteado en data/).
+    # Si no corresponde al Excel actual (se olvidó regenerarlo), se lee el Excel.
+    parquet_ok = parquet_vigente(UE_XLSX, UE_PARQUET)
+    if parquet_ok:
+        df = pd.read_parquet(UE_PARQUET)
+    else:
+        df = pd.read_excel(UE_XLSX, engine="calamine")
+    df.attrs["parquet_desactualizado"] = not parquet_ok
+
+    for col in UE_COLUMNAS_TEXTO:
+        if col in df.columns:
+            df[col] = df[col].fillna("").astype(str).str.strip()
+
+    # Columnas de baja cardinalidad como category (categorías ya ordenadas)
+    for col in ("Responsable_Institucional", "NG"):
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    if "Responsable_Institucional" not in df.columns:
+        return {"df": df, "responsables": [], "por_responsable": {}, "opciones": {}}
+
+    # astype("category") ya deja las categorías ordenadas y sin duplicados
+    responsables = [r for r in df["Responsable_Institucional"].cat.categories if r]
+    # Particiones: {responsable: df de sus UEs indexado por codigo}, de SOLO LECTURA
+    por_responsable = {
+        k: v.set_index("codigo", drop=False)
+        for k, v in df.groupby("Responsable_Institucional", sort=False, observed=True)
+    }
+    # Opciones del selectbox de UE por responsable
+    opciones = {
+        k: (v["codigo"] + " - " + v["nombre"].astype(str).str.strip()).tolist()
+        for k, v in por_responsable.items()
+    }
+    return {
+        "df": df,
+        "responsables": responsables,
+        "por_responsable": por_responsable,
+        "opciones": opciones,
+    }
 
-df_ue = cargar_unidades_ejecutoras()
-df_ue["codigo"] = df_ue["codigo"].astype(str).str.strip()
-df_ue["NG"] = df_ue["NG"].astype(str).str.strip()
+ue = cargar_unidades_ejecutoras()
+df_ue = ue["df"]
+if df_ue.attrs.get("parquet_desactualizado"):
+    st.warning(
+        "⚠️ data/unidades_ejecutoras.parquet no corresponde al Excel actual: se está leyendo el .xlsx. "
+        "Ejecuta `python convertir_a_parquet.py`."
+    )
 
 # ================================
 # 1) Validar y preparar responsables
@@ -230,63 +286,54 @@ if "Responsable_Institucional" not in df_ue.columns:
     st.error("❌ Falta la columna 'Responsable_Institucional' en unidades_ejecutoras.xlsx")
     st.stop()
 
-df_ue["Responsable_Institucional"] = (
-    df_ue["Responsable_Institucional"]
-    .fillna("")
-    .astype(str)
-    .str.strip()
-)
-
-responsables = sorted([r for r in df_ue["Responsable_Institucional"].unique() if r])
+responsables = ue["responsables"]
 
+@st.cache_data(show_spinner=False)
 def get_image_base64(path):
     with open(path, "rb") as f:
         return base64.b64encode(f.read()).decode()
 
-def render_header():
+@st.cache_data(show_spinner=False)
+def _chrome_html() -> str:
+    # Header (logo + título) y footer: no dependen del usuario, se arman una sola vez
     logo_base64 = get_image_base64("logo.png")
 
     html = f"""
+<style>
+.footer {{
+    position: fixed;
+    left: 0;
+    bottom: 0;
+    width: 100%;
+    background-color: #F5F7FA;
+    color: #9AA0A6;
+    text-align: center;
+    padding: 10px 0;
+    font-size: 13px;
+    border-top: 1px solid #E0E6ED;
+    z-index: 100;
+}}
+</style>
 <div style="display:flex; align-items:center; gap:16px; margin-top:-10px; padding:6px 0;">
   <img src="data:image/png;base64,{logo_base64}" width="140" style="display:block;">
   <h1 style="margin:0; font-size:2.1rem; font-weight:600; line-height:1.2;">
     Registro de IT del Plan Estratégico Institucional (PEI)
   </h1>
 </div>
+<div class="footer">
+    App elaborada por la <b>Dirección Nacional de Coordinación y Planeamiento (DNCP)</b> – <b>CEPLAN</b>
+</div>
 """
+    return dedent(html)
 
-    st.markdown(dedent(html), unsafe_allow_html=True)
+def render_chrome():
+    st.markdown(_chrome_html(), unsafe_allow_html=True)
 
 
-render_header()
+render_chrome()
 
 #st.markdown("<h1 style='color:red'>PRUEBA</h1>", unsafe_allow_html=True)
 
-st.markdown(
-    """
-    <style>
-    .footer {
-        position: fixed;
-        left: 0;
-        bottom: 0;
-        width: 100%;
-        background-color: #F5F7FA;
-        color: #9AA0A6;
-        text-align: center;
-        padding: 10px 0;
-        font-size: 13px;
-        border-top: 1px solid #E0E6ED;
-        z-index: 100;
-    }
-    </style>
-
-    <div class="footer">
-        App elaborada por la <b>Dirección Nacional de Coordinación y Planeamiento (DNCP)</b> – <b>CEPLAN</b>
-    </div>
-    """,
-    unsafe_allow_html=True
-)
-
 
 # ================================
 # 2) Filtro 1: Responsable Institucional
@@ -307,7 +354,7 @@ if not resp_sel:
 # ================================
 # 3) Filtrar df_ue por responsable + Filtro 2: UE (código o nombre)
 # ================================
-df_ue_filtrado = df_ue[df_ue["Responsable_Institucional"] == resp_sel].copy() 
+df_ue_filtrado = ue["por_responsable"].get(resp_sel, df_ue.iloc[:0].set_index("codigo", drop=False))
 
 st.caption(f"Unidades ejecutoras asignadas: {len(df_ue_filtrado)}") 
 
@@ -315,9 +362,8 @@ if df_ue_filtrado.empty:
     st.warning("No hay unidades ejecutoras asociadas a este responsable.") 
     st.stop() 
 
-# Crear opciones combinadas para búsqueda (solo del filtrado) 
-opciones = [ 
-    f"{str(row['codigo']).strip()} - {str(row['nombre']).strip()}" for _, row in df_ue_filtrado.iterrows() ] 
+# Opciones combinadas para búsqueda (solo del filtrado), precalculadas en la carga
+opciones = ue["opciones"][resp_sel]
 seleccion = st.selectbox( 
     "Escriba o seleccione el código o nombre del pliego", 
     opciones, 
@@ -333,12 +379,11 @@ if seleccion:
     codigo = seleccion.split(" - ")[0].strip()
 
     # 4) Ajuste: usar df_ue_filtrado en vez de df_ue
-    fila = df_ue_filtrado[df_ue_filtrado["codigo"] == codigo]
-
-    if not fila.empty:
-        sector = fila["sector"].iloc[0] if "sector" in fila.columns else ""
-        nivel_gob = fila["NG"].iloc[0]
-        responsable = fila["Responsable_Institucional"].iloc[0] if "Responsable_Institucional" in fila.columns else "No registrado"
+    #    (df_ue_filtrado está indexado por codigo: búsquedas .at en O(1))
+    if codigo in df_ue_filtrado.index:
+        sector = df_ue_filtrado.at[codigo, "sector"] if "sector" in df_ue_filtrado.columns else ""
+        nivel_gob = df_ue_filtrado.at[codigo, "NG"]
+        responsable = df_ue_filtrado.at[codigo, "Responsable_Institucional"] if "Responsable_Institucional" in df_ue_filtrado.columns else "No registrado"
 
         st.markdown(
             f"""
@@ -398,68 +443,35 @@ if "modo" in st.session_state and seleccion:
         try:
             # 1) Leer historial desde Postgres filtrado por Id_UE
             #    Importante: equivalente de tu columna "codigo" es "id_ue"
-            query = """
-                SELECT
-                  id,  -- ✅ necesario para UPDATE
-                  anio,
-                  ng1,
-                  ng2,
-                  fecha_recepcion,
-                  periodo_pei,
-                  vigencia,
-                  tipo_pei,
-                  estado,
-                  responsable_institucional,
-                  cantidad_revisiones,
-                  fecha_derivacion,
-                  etapas_revision,
-                  comentario_adicional_emisor_it,
-                  articulacion,
-                  expediente,
-                  fecha_it,
-                  numero_it,
-                  fecha_oficio,
-                  numero_oficio,
-                  created_at
-                FROM it_pei_historial
-                WHERE id_ue = %(id_ue)s
-                ORDER BY fecha_recepcion DESC NULLS LAST, created_at DESC
-            """
-    
-            df_historial = pd.read_sql(query, con=engine, params={"id_ue": codigo_norm})
+            #    Solo llegan las 5 filas más recientes; total_filas es el conteo completo
+            df_historial, total_filas = fetch_historial_ue(engine, codigo_norm)
+
+            # Valores de selectbox canónicos en un solo pase por columna
+            for col, mapping in HIST_CHOICE_MAPS.items():
+                if col in df_historial.columns:
+                    df_historial[col] = normalize_col(df_historial[col], mapping)
     
         except Exception as e:
             st.error(f"❌ Error al consultar el historial desde Postgres: {e}")
             st.stop()
     
-        st.write("Filas encontradas para este pliego:", len(df_historial))
+        st.write("Filas encontradas para este pliego:", total_filas)
     
         if df_historial.empty:
             st.info("No existe historial para este pliego (según la clave de comparación).")
     
         else:
-            # 6) Preparar fecha para identificar último registro
-            if "fecha_recepcion" in df_historial.columns:
-                df_historial["fecha_recepcion"] = pd.to_datetime(
-                    df_historial["fecha_recepcion"], errors="coerce"
-                )
-    
-            # 7) Mostrar últimas filas
+            # 7) Mostrar las 5 filas más recientes (antes: tail(5) del orden DESC,
+            #    es decir las 5 más antiguas)
             st.dataframe(
-                df_historial.tail(5),
+                df_historial,
                 use_container_width=True,
                 hide_index=True
             )
     
             # 8) Detectar último registro
-            #    Nota: la consulta ya viene ordenada DESC por fecha_recepcion y created_at.
-            #    Aun así, mantengo tu fallback.
-            if "fecha_recepcion" in df_historial.columns:
-                ultimo = df_historial.sort_values(
-                    ["fecha_recepcion", "created_at"], ascending=[False, False]
-                ).iloc[0]
-            else:
-                ultimo = df_historial.iloc[0]
+            #    La consulta ya viene ordenada DESC por fecha_recepcion y created_at.
+            ultimo = df_historial.iloc[0]
     
             st.success("Último registro encontrado.")
     
@@ -497,6 +509,10 @@ if "modo" in st.session_state and seleccion:
     
         init_form_state()
         form = st.session_state[FORM_STATE_KEY]
+
+        # Fecha única para todo el render del formulario
+        today = datetime.now().date()
+        year_now = today.year
     
         # Flags de edición (se activan cuando vienes desde Historial)
         edit_mode = st.session_state.get("edit_mode", False)
@@ -518,7 +534,6 @@ if "modo" in st.session_state and seleccion:
             col1, col2, col3, col4 = st.columns([1, 1, 1.3, 1])
     
             with col1:
-                year_now = datetime.now().year
                 año = st.text_input("Año", value=str(year_now), disabled=True)
     
                 tipo_pei_opts = ["Formulado", "Ampliado", "Actualizado"]
@@ -548,14 +563,14 @@ if "modo" in st.session_state and seleccion:
             with col2:
                 fecha_recepcion = st.date_input(
                     "Fecha de recepción",
-                    value=form["fecha_recepcion"] if form.get("fecha_recepcion") else datetime.now().date(),
+                    value=form["fecha_recepcion"] if form.get("fecha_recepcion") else today,
                     disabled=edit_mode  # 🔒 solo lectura en UPDATE
                 )
                 if edit_mode:
                     st.caption("🔒 Fecha de recepción bloqueada en modo actualización")
     
                 # Nivel desde df_ue_filtrado
-                nivel = df_ue_filtrado.loc[df_ue_filtrado["codigo"] == codigo, "NG"].values[0]
+                nivel = df_ue_filtrado.at[codigo, "NG"]
     
                 if nivel == "Gobierno regional":
                     opciones_articulacion = ["PEDN 2050", "PDRC"]
@@ -577,7 +592,7 @@ if "modo" in st.session_state and seleccion:
     
                 fecha_derivacion = st.date_input(
                     "Fecha de derivación",
-                    value=form["fecha_derivacion"] if form.get("fecha_derivacion") else datetime.now().date()
+                    value=form["fecha_derivacion"] if form.get("fecha_derivacion") else today
                 )
     
             with col3:
@@ -634,11 +649,11 @@ if "modo" in st.session_state and seleccion:
             with colB:
                 fecha_it = st.date_input(
                     "Fecha de I.T",
-                    value=form["fecha_it"] if form.get("fecha_it") else datetime.now().date()
+                    value=form["fecha_it"] if form.get("fecha_it") else today
                 )
                 fecha_oficio = st.date_input(
                     "Fecha del Oficio",
-                    value=form["fecha_oficio"] if form.get("fecha_oficio") else datetime.now().date()
+                    value=form["fecha_oficio"] if form.get("fecha_oficio") else today
                 )
     
             with colC:
@@ -694,7 +709,7 @@ if "modo" in st.session_state and seleccion:
                         # INSERT: incluye todo
                         nuevo_pg = {
                             "id_ue": str(codigo).strip(),  # ideal: usa tu normalizar_codigo(codigo)
-                            "anio": int(datetime.now().year),
+                            "anio": year_now,
     
                             "fecha_recepcion": fecha_recepcion,
                             "periodo_pei": periodo,
@@ -0,0 +1,53 @@
+"""
+Conversión única de data/unidades_ejecutoras.xlsx a Parquet.
+Ejecutar cada vez que se actualice el Excel fuente (y commitear el .parquet):
+
+    python convertir_a_parquet.py
+
+El Parquet guarda el SHA-256 del Excel de origen en sus metadatos; la app
+usa parquet_vigente() para no servir un Parquet generado desde otro Excel.
+"""
+import hashlib
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ORIGEN = "data/unidades_ejecutoras.xlsx"
+DESTINO = "data/unidades_ejecutoras.parquet"
+
+_META_FUENTE = b"fuente_sha256"
+
+
+def sha256_archivo(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def parquet_vigente(origen: str = ORIGEN, destino: str = DESTINO) -> bool:
+    """
+    True si el Parquet existe y fue generado desde el Excel actual.
+    Compara contenido (hash), no mtimes: un git checkout no conserva fechas.
+    """
+    try:
+        meta = pq.read_schema(destino).metadata or {}
+    except (FileNotFoundError, OSError):
+        return False
+    return meta.get(_META_FUENTE, b"").decode() == sha256_archivo(origen)
+
+
+def convertir(origen: str = ORIGEN, destino: str = DESTINO) -> None:
+    df = pd.read_excel(origen, engine="calamine")
+    # Columnas con tipos mezclados (p. ej. una fórmula en id_pliego): Parquet exige
+    # un tipo por columna, se guardan como texto conservando los vacíos
+    for c in [c for c in df.columns if df[c].dtype == object]:
+        df[c] = df[c].where(df[c].isna(), df[c].astype(str))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    meta = dict(table.schema.metadata or {})
+    meta[_META_FUENTE] = sha256_archivo(origen).encode()
+    pq.write_table(table.replace_schema_metadata(meta), destino, compression="zstd")
+    print(f"✅ {destino} generado ({len(df)} filas)")
+
+
+if __name__ == "__main__":
+    convertir()
@@ -1,15 +1,134 @@
 from __future__ import annotations
-from typing import Any, Dict, Optional
-from sqlalchemy import create_engine, text
+import io
+from functools import lru_cache, wraps
+from typing import Any, Dict, FrozenSet, List, Literal, Optional, Tuple, Union
+from psycopg2.extras import execute_values
+from sqlalchemy import Date, DateTime, Integer, String, bindparam, create_engine, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import DBAPIError, DisconnectionError
+from sqlalchemy.sql.elements import TextClause
 from urllib.parse import quote_plus
 import streamlit as st
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 
+try:
+    import connectorx as cx  # opcional: backend rápido de lectura para search_history
+except ImportError:
+    cx = None
+
+
+@st.cache_resource(show_spinner=False)
 def get_engine():
+    # Un solo Engine (y su pool) por proceso: los reruns de Streamlit lo reutilizan
     cfg = st.secrets["postgres"]
     pwd = quote_plus(cfg["password"])
     url = f'postgresql+psycopg2://{cfg["user"]}:{pwd}@{cfg["host"]}:{cfg["port"]}/{cfg["dbname"]}'
-    return create_engine(url, pool_pre_ping=True)
+    return create_engine(
+        url,
+        # pool_pre_ping: los INSERT/UPDATE del formulario no se reintentan, así que la
+        # conexión se valida antes de entregarla. keepalives + pool_recycle evitan que
+        # el ping falle seguido y las lecturas además reintentan una vez
+        # (_retry_on_disconnect) si la conexión cae a mitad de la consulta.
+        pool_pre_ping=True,
+        pool_size=10,
+        max_overflow=20,
+        pool_recycle=1800,
+        pool_reset_on_return="rollback",
+        # executemany (listas de dicts) como INSERT multi-VALUES + execute_batch
+        executemany_mode="values_plus_batch",
+        # - jit=off: consultas pequeñas, el JIT de Postgres solo agrega latencia
+        # - plan_cache_mode: las consultas parametrizadas de lectura (search_history,
+        #   fetch_last_by_ue) reutilizan el plan genérico cuando hay sentencias preparadas.
+        #   insert_it_pei arma su lista de columnas dinámicamente: no depende de este modo.
+        connect_args={
+            "options": "-c jit=off -c plan_cache_mode=force_generic_plan",
+            "keepalives": 1,
+            "keepalives_idle": 30,
+            "keepalives_interval": 10,
+            "keepalives_count": 3,
+            "application_name": "it_pei",
+        },
+    )
+
+
+# Índice para "historial por UE, más reciente primero": el ORDER BY + LIMIT
+# se resuelve recorriendo el índice en vez de ordenar todas las filas del pliego.
+# Sin INCLUDE: las consultas leen casi todas las columnas, así que igual van a la
+# tabla; con LIMIT son pocas filas y cubrir columnas solo agrandaría el índice.
+# Se crea con migraciones.py (CONCURRENTLY: no bloquea escrituras), no al iniciar la app.
+IX_IT_PEI_UE_RECENT_DDL = """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_it_pei_ue_recent
+    ON it_pei_historial (id_ue, fecha_recepcion DESC NULLS LAST, created_at DESC, id DESC)
+"""
+
+
+def ensure_indexes(engine) -> None:
+    # CREATE INDEX CONCURRENTLY no puede correr dentro de una transacción
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql(IX_IT_PEI_UE_RECENT_DDL)
+
+
+# Espejo en Postgres del antiguo data/historial_it_pei.xlsx: mismas columnas + codigo_ue_norm.
+# Esquema explícito: to_sql no debe inferirlo de la primera fila guardada.
+HISTORIAL_EXCEL_TABLE = "it_pei_historial_excel_mirror"
+
+HISTORIAL_EXCEL_COLUMNS = (
+    "codigo", "nombre", "año", "periodo", "vigencia", "tipo_pei", "estado",
+    "responsable_institucional", "cantidad_revisiones", "etapa_revision",
+    "fecha_recepcion", "fecha_derivacion", "articulacion", "expediente",
+    "fecha_it", "numero_it", "fecha_oficio", "numero_oficio", "comentario",
+    "codigo_ue_norm",
+)
+
+HISTORIAL_EXCEL_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {HISTORIAL_EXCEL_TABLE} (
+        codigo                    TEXT,
+        nombre                    TEXT,
+        "año"                     INTEGER,
+        periodo                   TEXT,
+        vigencia                  TEXT,
+        tipo_pei                  TEXT,
+        estado                    TEXT,
+        responsable_institucional TEXT,
+        cantidad_revisiones       INTEGER,
+        etapa_revision            TEXT,
+        fecha_recepcion           DATE,
+        fecha_derivacion          DATE,
+        articulacion              TEXT,
+        expediente                TEXT,
+        fecha_it                  DATE,
+        numero_it                 TEXT,
+        fecha_oficio              DATE,
+        numero_oficio             TEXT,
+        comentario                TEXT,
+        codigo_ue_norm            TEXT
+    )
+"""
+
+
+def ensure_historial_excel_table(engine) -> None:
+    with engine.begin() as conn:
+        conn.exec_driver_sql(HISTORIAL_EXCEL_DDL)
+
+
+def _retry_on_disconnect(fn):
+    """
+    Reintenta UNA vez si la conexión del pool estaba caída.
+    Solo para lecturas: reintentar es seguro porque no hay efectos secundarios.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except DisconnectionError:
+            pass
+        except DBAPIError as e:
+            if not e.connection_invalidated:
+                raise
+        return fn(*args, **kwargs)
+    return wrapper
 
 
 def _clean_str(x: Any) -> Optional[str]:
@@ -28,88 +147,440 @@ def _to_int(x: Any) -> Optional[int]:
         return None
 
 
+_SEARCH_COLUMNS = """
+          id, id_ue,
+          anio, ng1, ng2, fecha_recepcion, periodo_pei, vigencia, tipo_pei, estado,
+          responsable_institucional, cantidad_revisiones, fecha_derivacion, etapas_revision,
+          comentario_adicional_emisor_it, articulacion, expediente, fecha_it, numero_it,
+          fecha_oficio, numero_oficio,
+          created_at, created_by
+"""
+
+_Q_FETCH_LAST = text(f"""
+    SELECT
+{_SEARCH_COLUMNS}
+    FROM it_pei_historial
+    WHERE id_ue = :id_ue
+    ORDER BY fecha_recepcion DESC NULLS LAST, created_at DESC, id DESC
+    LIMIT 1
+""").bindparams(bindparam("id_ue", type_=String))
+
+
+@_retry_on_disconnect
 def fetch_last_by_ue(engine, id_ue: str) -> Optional[Dict[str, Any]]:
-    q = text("""
-        SELECT *
-        FROM it_pei_historial
-        WHERE id_ue = :id_ue
-        ORDER BY fecha_recepcion DESC NULLS LAST, created_at DESC
-        LIMIT 1
-    """)
     with engine.begin() as conn:
-        row = conn.execute(q, {"id_ue": id_ue}).mappings().first()
+        row = conn.execute(_Q_FETCH_LAST, {"id_ue": id_ue}).mappings().first()
     return dict(row) if row else None
 
 
-def insert_it_pei(engine, record: Dict[str, Any]) -> None:
-    # obligatorios
-    required = ["id_ue", "fecha_recepcion"]
-    missing = [k for k in required if not record.get(k)]
+# Historial de un pliego para la app: las filas más recientes + el conteo total.
+# El conteo va en una consulta aparte: un COUNT(*) OVER () obligaría a leer todas
+# las filas del pliego antes del LIMIT y el índice ya no serviría el ORDER BY.
+_Q_HISTORIAL_UE = text("""
+    SELECT
+      id,  -- ✅ necesario para UPDATE
+      anio,
+      ng1,
+      ng2,
+      fecha_recepcion,
+      periodo_pei,
+      vigencia,
+      tipo_pei,
+      estado,
+      responsable_institucional,
+      cantidad_revisiones,
+      fecha_derivacion,
+      etapas_revision,
+      comentario_adicional_emisor_it,
+      articulacion,
+      expediente,
+      fecha_it,
+      numero_it,
+      fecha_oficio,
+      numero_oficio,
+      created_at
+    FROM it_pei_historial
+    WHERE id_ue = :id_ue
+    ORDER BY fecha_recepcion DESC NULLS LAST, created_at DESC, id DESC
+    LIMIT :limit
+""").bindparams(bindparam("id_ue", type_=String), bindparam("limit", type_=Integer))
+
+_Q_COUNT_UE = text("""
+    SELECT COUNT(*) FROM it_pei_historial WHERE id_ue = :id_ue
+""").bindparams(bindparam("id_ue", type_=String))
+
+
+@_retry_on_disconnect
+def fetch_historial_ue(engine, id_ue: str, limit: int = 5) -> Tuple[pd.DataFrame, int]:
+    """
+    Devuelve (las `limit` filas más recientes del pliego, total de filas del pliego).
+    """
+    with engine.connect() as conn:
+        df = pd.read_sql(_Q_HISTORIAL_UE, conn, params={"id_ue": id_ue, "limit": limit})
+        total = conn.execute(_Q_COUNT_UE, {"id_ue": id_ue}).scalar_one()
+    return df, int(total)
+
+
+# Último registro de varias UEs en una sola consulta (psycopg2 envía la lista como array)
+_Q_FETCH_LAST_MANY = text(f"""
+    SELECT DISTINCT ON (id_ue)
+{_SEARCH_COLUMNS}
+    FROM it_pei_historial
+    WHERE id_ue = ANY(:ids)
+    ORDER BY id_ue, fecha_recepcion DESC NULLS LAST, created_at DESC, id DESC
+""").bindparams(bindparam("ids", type_=ARRAY(String)))
+
+_FETCH_MANY_CHUNK = 10_000
+
+
+@_retry_on_disconnect
+def fetch_last_by_ues(engine, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Versión por lotes de fetch_last_by_ue: {id_ue: último registro}.
+    Las UEs sin historial no aparecen en el resultado.
+    """
+    ids = list(dict.fromkeys(ids))
+    out: Dict[str, Dict[str, Any]] = {}
+    with engine.begin() as conn:
+        for i in range(0, len(ids), _FETCH_MANY_CHUNK):
+            chunk = ids[i:i + _FETCH_MANY_CHUNK]
+            for r in conn.execute(_Q_FETCH_LAST_MANY, {"ids": chunk}).mappings():
+                out[r["id_ue"]] = dict(r)
+    return out
+
+
+@lru_cache(maxsize=32)
+def _insert_stmt(keys: FrozenSet[str]) -> TextClause:
+    # El formulario casi siempre envía las mismas columnas: un TextClause por esquema
+    cols = sorted(keys)
+    return text(f"""
+        INSERT INTO it_pei_historial ({", ".join(cols)})
+        VALUES ({", ".join(f":{c}" for c in cols)})
+    """)
+
+
+_REQUIRED_COLS = ("id_ue", "fecha_recepcion")
+_INT_COLS = ("anio", "cantidad_revisiones")
+_STR_COLS = ("id_ue",)
+
+
+def _coerce_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    # Validación + coerción de un registro, común a insert_it_pei e insert_it_pei_bulk.
+    # anio / cantidad_revisiones siempre se bindean (NULL si faltan).
+    missing = [k for k in _REQUIRED_COLS if not record.get(k)]
     if missing:
         raise ValueError(f"Faltan campos obligatorios: {', '.join(missing)}")
 
-    record = dict(record)
-    record["id_ue"] = _clean_str(record.get("id_ue"))
-    record["anio"] = _to_int(record.get("anio"))
-    record["cantidad_revisiones"] = _to_int(record.get("cantidad_revisiones"))
+    # El dict del llamador no se modifica: se combina con las columnas coercionadas
+    overrides = {
+        "id_ue": _clean_str(record.get("id_ue")),
+        "anio": _to_int(record.get("anio")),
+        "cantidad_revisiones": _to_int(record.get("cantidad_revisiones")),
+    }
+    return {**record, **overrides}
 
-    cols = list(record.keys())
-    col_list = ", ".join(cols)
-    param_list = ", ".join([f":{c}" for c in cols])
 
-    q = text(f"""
-        INSERT INTO it_pei_historial ({col_list})
-        VALUES ({param_list})
-    """)
+def _prepare_insert(record: Dict[str, Any]) -> Tuple[TextClause, Dict[str, Any]]:
+    # Validación, coerción y sentencia: todo antes de pedir una conexión al pool
+    bind = _coerce_record(record)
+    return _insert_stmt(frozenset(bind)), bind
 
-    with engine.begin() as conn:
-        conn.execute(q, record)
 
+def insert_it_pei(engine, record: Dict[str, Any]) -> None:
+    stmt, bind = _prepare_insert(record)
+    with engine.connect() as conn:
+        conn.execute(stmt, bind)
+        conn.commit()
 
-def search_history(engine, filters: Dict[str, Any], limit: int = 500) -> pd.DataFrame:
-    where = []
-    params: Dict[str, Any] = {}
 
-    if filters.get("id_ue"):
-        where.append("id_ue = :id_ue")
-        params["id_ue"] = filters["id_ue"]
+def _coerce_frame(
+    df: pd.DataFrame,
+    int_cols: Tuple[str, ...] = _INT_COLS,
+    str_cols: Tuple[str, ...] = _STR_COLS,
+) -> pd.DataFrame:
+    """
+    Equivalente vectorizado de _to_int / _clean_str para un DataFrame completo.
+    """
+    df = df.copy()
+    int_cols = [c for c in int_cols if c in df.columns]
+    str_cols = [c for c in str_cols if c in df.columns]
 
-    if filters.get("estado"):
-        where.append("estado = :estado")
-        params["estado"] = filters["estado"]
+    for c in int_cols:
+        # int(float(x)): trunca decimales; lo no numérico queda como NA
+        df[c] = np.trunc(pd.to_numeric(df[c], errors="coerce")).astype("Int64")
 
-    if filters.get("tipo_pei"):
-        where.append("tipo_pei = :tipo_pei")
-        params["tipo_pei"] = filters["tipo_pei"]
+    if str_cols:
+        df[str_cols] = (
+            df[str_cols].astype("string").apply(lambda s: s.str.strip()).replace({"": pd.NA})
+        )
+    return df
 
-    if filters.get("fecha_recepcion_desde"):
-        where.append("fecha_recepcion >= :fr_desde")
-        params["fr_desde"] = filters["fecha_recepcion_desde"]
 
-    if filters.get("fecha_recepcion_hasta"):
-        where.append("fecha_recepcion <= :fr_hasta")
-        params["fr_hasta"] = filters["fecha_recepcion_hasta"]
+def _filas_incompletas(df: pd.DataFrame) -> pd.Series:
+    # Igual que `not record.get(k)`: NA, "" o solo espacios cuentan como faltante
+    incompletos = pd.Series(False, index=df.index)
+    for c in _REQUIRED_COLS:
+        vacio = df[c].astype("string").str.strip().eq("").fillna(False)
+        incompletos |= df[c].isna() | vacio
+    return incompletos
 
-    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
-    params["limit"] = limit
 
-    q = text(f"""
+def _validate_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # Validación común de insert_it_pei_frame y bulk_load_it_pei; devuelve el df coercionado
+    missing = [c for c in _REQUIRED_COLS if c not in df.columns]
+    if missing:
+        raise ValueError(f"Faltan columnas obligatorias: {', '.join(missing)}")
+
+    df = _coerce_frame(df)
+    incompletos = _filas_incompletas(df)
+    if incompletos.any():
+        raise ValueError(f"Filas sin campos obligatorios: {df.index[incompletos].tolist()[:10]}")
+    return df
+
+
+def _insert_records(engine, records: List[Dict[str, Any]], page_size: int) -> None:
+    # Agrupa por conjunto de columnas: un INSERT multi-VALUES por grupo
+    buckets: Dict[Tuple[str, ...], List[tuple]] = {}
+    for record in records:
+        cols = tuple(sorted(record))
+        buckets.setdefault(cols, []).append(tuple(record[c] for c in cols))
+
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            for cols, rows in buckets.items():
+                q = f"INSERT INTO it_pei_historial ({', '.join(cols)}) VALUES %s"
+                execute_values(cur, q, rows, page_size=page_size)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def insert_it_pei_bulk(engine, records: List[Dict[str, Any]], page_size: int = 1000) -> int:
+    """
+    Inserta varios registros con INSERT multi-VALUES (psycopg2 execute_values):
+    un round-trip por página de page_size filas.
+    Misma validación y coerción que insert_it_pei (_coerce_record): el mismo registro
+    produce la misma fila por cualquiera de los dos caminos.
+    Los registros se agrupan por conjunto de columnas; cada grupo usa su propio INSERT.
+    Todo corre en una sola transacción. Devuelve la cantidad de filas insertadas.
+    """
+    if not records:
+        return 0
+
+    cleaned = []
+    for i, record in enumerate(records):
+        try:
+            cleaned.append(_coerce_record(record))
+        except ValueError as e:
+            raise ValueError(f"Registro {i}: {e}") from None
+
+    _insert_records(engine, cleaned, page_size)
+    return len(cleaned)
+
+
+def insert_it_pei_frame(engine, df: pd.DataFrame, page_size: int = 1000) -> int:
+    """
+    Como insert_it_pei_bulk, pero para un DataFrame: la coerción se hace por columna
+    (_coerce_frame) en vez de celda por celda.
+    """
+    if df.empty:
+        return 0
+
+    df = _validate_frame(df)
+
+    # NA -> None y escalares nativos de Python para psycopg2
+    records = df.astype(object).where(df.notna(), None).to_dict(orient="records")
+    _insert_records(engine, records, page_size)
+    return len(records)
+
+
+def bulk_load_it_pei(engine, df: pd.DataFrame) -> int:
+    """
+    Carga masiva con COPY ... FROM STDIN (CSV): sin parseo/plan por fila en el servidor.
+    Para procesos por lotes (miles de filas), no para el guardado del formulario.
+    Nota: en CSV de COPY los textos vacíos se cargan como NULL.
+    """
+    if df.empty:
+        return 0
+
+    df = _validate_frame(df)
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep="")
+    buffer.seek(0)
+
+    q = f"COPY it_pei_historial ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT CSV)"
+
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert(q, buffer)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return len(df)
+
+
+# filtro -> (fragmento SQL, nombre del bind)
+_FILTER_CLAUSES = {
+    "id_ue": ("id_ue = :id_ue", "id_ue"),
+    "estado": ("estado = :estado", "estado"),
+    "tipo_pei": ("tipo_pei = :tipo_pei", "tipo_pei"),
+    "fecha_recepcion_desde": ("fecha_recepcion >= :fr_desde", "fr_desde"),
+    "fecha_recepcion_hasta": ("fecha_recepcion <= :fr_hasta", "fr_hasta"),
+}
+
+# Paginación por keyset: filas estrictamente "después" del cursor en el mismo orden del
+# ORDER BY (fecha_recepcion DESC NULLS LAST, created_at DESC, id DESC); id desempata filas
+# con la misma fecha y created_at. Con NULLS LAST las filas sin fecha van al final, así
+# que hay dos variantes según el cursor tenga fecha o no.
+_KEYSET_CLAUSES = {
+    "con_fecha": (
+        "(fecha_recepcion IS NULL"
+        " OR (fecha_recepcion, created_at, id) < (:af_fr, :af_ct, :af_id))",
+        ("af_fr", "af_ct", "af_id"),
+    ),
+    "sin_fecha": (
+        "(fecha_recepcion IS NULL AND (created_at, id) < (:af_ct, :af_id))",
+        ("af_ct", "af_id"),
+    ),
+}
+
+# Tipos declarados de cada bind: SQLAlchemy no los infiere en cada llamada
+_BIND_TYPES = {
+    "id_ue": String,
+    "estado": String,
+    "tipo_pei": String,
+    "fr_desde": Date,
+    "fr_hasta": Date,
+    "af_fr": Date,
+    "af_ct": DateTime,
+    "af_id": Integer,
+    "limit": Integer,
+}
+
+_STREAM_CHUNK_SIZE = 5000
+
+# Enteros pequeños: int32 en lugar del int64 que infiere Arrow
+_NARROW_TYPES = {
+    "anio": pa.int32(),
+    "cantidad_revisiones": pa.int32(),
+}
+
+
+@lru_cache(maxsize=64)
+def _build_search_stmt(active_keys: Tuple[str, ...], keyset: Optional[str] = None) -> TextClause:
+    # Un TextClause por combinación de filtros: se arma y se parsea una sola vez
+    # keyset: None, "con_fecha" o "sin_fecha" (ver _KEYSET_CLAUSES)
+    where = [_FILTER_CLAUSES[k][0] for k in active_keys]
+    binds = [_FILTER_CLAUSES[k][1] for k in active_keys] + ["limit"]
+    if keyset:
+        clause, keyset_binds = _KEYSET_CLAUSES[keyset]
+        where.append(clause)
+        binds += list(keyset_binds)
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+    return text(f"""
         SELECT
-          id, id_ue,
-          anio, ng1, ng2, fecha_recepcion, periodo_pei, vigencia, tipo_pei, estado,
-          responsable_institucional, cantidad_revisiones, fecha_derivacion, etapas_revision,
-          comentario_adicional_emisor_it, articulacion, expediente, fecha_it, numero_it,
-          fecha_oficio, numero_oficio,
-          created_at, created_by
+{_SEARCH_COLUMNS}
         FROM it_pei_historial
         {where_sql}
-        ORDER BY fecha_recepcion DESC NULLS LAST, created_at DESC
+        ORDER BY fecha_recepcion DESC NULLS LAST, created_at DESC, id DESC
         LIMIT :limit
-    """)
+    """).bindparams(*(bindparam(b, type_=_BIND_TYPES[b]) for b in binds))
 
-    with engine.begin() as conn:
-        df = pd.read_sql(q, conn, params=params)
 
+def _read_arrow_sqlalchemy(engine, q: TextClause, params: Dict[str, Any]) -> pa.Table:
+    # Cursor del lado del servidor: las filas llegan por bloques y se pasan a Arrow
+    # sin materializar antes toda la lista de tuplas de Python
+    tables = []
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=10_000).execute(q, params)
+        columns = list(result.keys())
+        for chunk in result.mappings().partitions(_STREAM_CHUNK_SIZE):
+            tables.append(pa.Table.from_pylist([dict(r) for r in chunk]))
+
+    if not tables:
+        return pa.table({c: pa.array([], type=pa.null()) for c in columns})
+
+    # promote: una columna 100% nula en un bloque no debe romper la concatenación
+    return pa.concat_tables(tables, promote_options="default")
+
+
+def _read_arrow_connectorx(engine, q: TextClause, params: Dict[str, Any]) -> pa.Table:
+    # connectorx no recibe parámetros: se renderiza el SQL con literales escapados
+    sql = str(q.bindparams(**params).compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+    url = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+    return cx.read_sql(url, sql, return_type="arrow")
+
+
+@_retry_on_disconnect
+def search_history(
+    engine,
+    filters: Dict[str, Any],
+    limit: int = 500,
+    backend: str = "sqlalchemy",
+    format: Literal["dataframe", "records", "arrow"] = "dataframe",
+) -> Union[pd.DataFrame, List[Dict[str, Any]], pa.Table]:
+    """
+    Busca en el historial, más reciente primero.
+    Para la página siguiente, pasar filters["after"] = df.attrs["next_cursor"] de la
+    página anterior: (fecha_recepcion o None, created_at, id); None si no hay más.
+    backend="connectorx" lee Postgres directo a Arrow (si connectorx está instalado;
+    si no, se usa SQLAlchemy).
+    format: "dataframe" (por defecto), "records" (lista de dicts, sin pasar por
+    Arrow ni pandas) o "arrow" (pyarrow.Table, sin pasar por pandas).
+    """
+    # Una sola pasada: el orden fijo de _FILTER_CLAUSES ya da una clave canónica
+    active = []
+    params: Dict[str, Any] = {"limit": limit}
+    for key, (_, bind) in _FILTER_CLAUSES.items():
+        if v := filters.get(key):
+            active.append(key)
+            params[bind] = v
+    active_keys = tuple(active)
+
+    keyset = None
+    if after := filters.get("after"):
+        af_fr, params["af_ct"], params["af_id"] = after
+        if af_fr is None:
+            keyset = "sin_fecha"
+        else:
+            keyset = "con_fecha"
+            params["af_fr"] = af_fr
+
+    q = _build_search_stmt(active_keys, keyset)
+
+    if format == "records":
+        with engine.connect() as conn:
+            return [dict(r) for r in conn.execute(q, params).mappings()]
+
+    if backend == "connectorx" and cx is not None:
+        table = _read_arrow_connectorx(engine, q, params)
+    else:
+        table = _read_arrow_sqlalchemy(engine, q, params)
+
+    for c, tipo in _NARROW_TYPES.items():
+        idx = table.schema.get_field_index(c)
+        if idx >= 0:
+            table = table.set_column(idx, c, table.column(c).cast(tipo))
+    if format == "arrow":
+        return table
+
+    df = table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    df.attrs["next_cursor"] = None
+    if limit > 0 and len(df) == limit:
+        last = df.iloc[-1]
+        fr = None if pd.isna(last["fecha_recepcion"]) else last["fecha_recepcion"]
+        df.attrs["next_cursor"] = (fr, last["created_at"], int(last["id"]))
     return df
 
 from sqlalchemy import text
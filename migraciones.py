@@ -0,0 +1,18 @@
+"""
+DDL de la base del formulario. Ejecutar una vez por despliegue, con un rol dueño
+de las tablas (no corre al iniciar la app):
+
+    python migraciones.py
+"""
+from db_it_pei import ensure_historial_excel_table, ensure_indexes, get_engine
+
+
+def migrar() -> None:
+    engine = get_engine()
+    ensure_indexes(engine)
+    ensure_historial_excel_table(engine)
+    print("✅ Índices y tabla espejo creados (o ya existían)")
+
+
+if __name__ == "__main__":
+    migrar()
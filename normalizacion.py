@@ -0,0 +1,105 @@
+"""
+Normalización de valores del historial (Postgres / Excel antiguo) a los valores
+exactos del formulario. Vive fuera de app.py porque Streamlit re-ejecuta el script
+completo en cada rerun: aquí los mapeos y la regex se construyen una sola vez.
+"""
+import re
+
+import pandas as pd
+
+# Mapeos a los valores EXACTOS que usa tu formulario (claves ya normalizadas)
+ESTADO_MAP = {
+    "emitido": "Emitido",
+    "en proceso": "En proceso",
+    "proceso": "En proceso",
+}
+
+VIGENCIA_MAP = {
+    "sí": "Sí",
+    "si": "Sí",
+    "no": "No",
+}
+
+TIPO_PEI_MAP = {
+    "formulado": "Formulado",
+    "ampliado": "Ampliado",
+    "actualizado": "Actualizado",
+}
+
+ETAPA_MAP = {
+    "it emitido": "IT Emitido",
+    "para emisión de it": "Para emisión de IT",
+    "para emision de it": "Para emisión de IT",
+    "revisión dncp": "Revisión DNCP",
+    "revision dncp": "Revisión DNCP",
+    "revisión dnse": "Revisión DNSE",
+    "revision dnse": "Revisión DNSE",
+    "revisión dnpe": "Revisión DNPE",
+    "revision dnpe": "Revisión DNPE",
+    "subsanación del pliego": "Subsanación del pliego",
+    "subsanacion del pliego": "Subsanación del pliego",
+}
+
+_WS = re.compile(r"\s+")
+_UNDERSCORE_A_ESPACIO = str.maketrans("_", " ")
+
+def norm_choice(val, mapping: dict, default: str):
+    """
+    Normalizador tolerante para valores de selectbox (mayúsculas, espacios, guiones bajos).
+    La mayoría de valores del historial ya vienen limpios: se resuelven con un solo dict.get.
+    """
+    s = "" if pd.isna(val) else str(val).strip().lower()
+    if s in mapping:
+        return mapping[s]
+    s = _WS.sub(" ", s.translate(_UNDERSCORE_A_ESPACIO)).strip()
+    return mapping.get(s, default)
+
+def normalize_col(s: pd.Series, mapping: dict, default=None) -> pd.Series:
+    """
+    Versión vectorizada de norm_choice para columnas completas del historial.
+    Si default es None, los valores no reconocidos se conservan tal cual.
+    """
+    claves = (
+        s.fillna("").astype(str).str.lower()
+        .str.replace("_", " ", regex=False)
+        .str.replace(r"\s+", " ", regex=True)
+        .str.strip()
+    )
+    return claves.map(mapping).fillna(s if default is None else default)
+
+# Columna del historial (Postgres) -> mapeo de valores canónicos
+HIST_CHOICE_MAPS = {
+    "tipo_pei": TIPO_PEI_MAP,
+    "etapas_revision": ETAPA_MAP,
+    "vigencia": VIGENCIA_MAP,
+    "estado": ESTADO_MAP,
+}
+
+# ============================================================
+# Resolver nombres de columnas (Postgres vs SharePoint)
+# ============================================================
+# Campo del formulario -> columnas candidatas, en orden de preferencia
+# (primero Postgres, luego nombres antiguos del Excel/SharePoint).
+FIELD_ALIASES = {
+    "tipo_pei": ("tipo_pei", "Tipo de PEI"),
+    "etapa_revision": ("etapas_revision", "etapa_revision", "Etapas de revisión"),
+    "fecha_recepcion": ("fecha_recepcion", "Fecha de recepción"),
+    "articulacion": ("articulacion", "Articulación"),
+    "fecha_derivacion": ("fecha_derivacion", "Fecha de derivación"),
+    "periodo": ("periodo_pei", "periodo", "Periodo PEI"),
+    "cantidad_revisiones": ("cantidad_revisiones", "Cantidad de revisiones"),
+    "comentario": ("comentario_adicional_emisor_it", "comentario", "Comentario adicional/ Emisor de I.T"),
+    "vigencia": ("vigencia", "Vigencia"),
+    "estado": ("estado", "Estado"),
+    "expediente": ("expediente", "Expediente"),
+    "fecha_it": ("fecha_it", "Fecha de I.T"),
+    "numero_it": ("numero_it", "Número de I.T"),
+    "fecha_oficio": ("fecha_oficio", "Fecha Oficio", "Fecha del Oficio"),
+    "numero_oficio": ("numero_oficio", "Número Oficio", "Número del Oficio"),
+}
+
+def first_present(row, keys, default):
+    for k in keys:
+        if k in row.index:
+            return row[k]
+    return default